@@ -12,10 +12,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import pathlib
+import sys
+import time
+import types
 import tomllib
+
+import ctranslate2.converters
+import faster_whisper
+import numpy as np
+import pytest
 from dorsal.testing import run_model
-from dorsal_whisper.model import FasterWhisperTranscriber
+from dorsal_whisper import model as whisper_model
+from dorsal_whisper.model import FasterWhisperTranscriber, _pick_compute_type
 
 TEST_ASSETS = pathlib.Path(__file__).parent / "assets"
 
@@ -55,22 +65,34 @@ def test_model_integration():
 
 
 def test_model_caching():
-    """Tests that the _load_model method properly caches and evicts models to save VRAM."""
+    """Tests that the _load_model method caches models and evicts the least recently used one."""
 
     transcriber = FasterWhisperTranscriber(file_path="dummy.wav")
+    compute_type = _pick_compute_type()
 
-    FasterWhisperTranscriber._active_model = None
+    FasterWhisperTranscriber._model_cache.clear()
 
     model_1 = transcriber._load_model("tiny", compute_type="default")
-    assert FasterWhisperTranscriber._active_model is not None
-    assert FasterWhisperTranscriber._active_model[0] == "tiny-default"
+    assert list(FasterWhisperTranscriber._model_cache) == [f"tiny-{compute_type}"]
 
     model_2 = transcriber._load_model("tiny", compute_type="default")
     assert model_1 is model_2, "Model was not loaded from cache!"
 
     model_3 = transcriber._load_model("base", compute_type="default")
-    assert FasterWhisperTranscriber._active_model[0] == "base-default"
-    assert model_3 is not model_1, "Cache did not evict the old model!"
+    assert model_3 is not model_1
+    assert list(FasterWhisperTranscriber._model_cache) == [
+        f"tiny-{compute_type}",
+        f"base-{compute_type}",
+    ]
+
+    model_4 = transcriber._load_model("tiny", compute_type="default")
+    assert model_4 is model_1, "Cached model was reloaded!"
+    assert list(FasterWhisperTranscriber._model_cache)[-1] == f"tiny-{compute_type}"
+
+    transcriber._load_model("tiny", compute_type="float32", max_cached_models=1)
+    assert list(FasterWhisperTranscriber._model_cache) == ["tiny-float32"], (
+        "Cache did not evict the least recently used model!"
+    )
 
 
 def test_word_timestamps():
@@ -121,3 +143,363 @@ def test_batched_inference():
     assert result.error is None, f"Batched inference failed: {result.error}"
     assert "text" in result.record
     assert len(result.record["text"]) > 0
+
+
+def test_unbatched_inference():
+    """Tests that batch_size=0 transcribes with the plain WhisperModel."""
+    audio_file = TEST_ASSETS / "OSR_uk_000_0020_8k.wav"
+
+    test_options = config.get("options", {}).copy()
+    test_options["batch_size"] = 0
+    test_options["model_size"] = "tiny"
+
+    result = run_model(
+        annotation_model=FasterWhisperTranscriber,
+        file_path=str(audio_file),
+        schema_id=config["schema_id"],
+        validation_model=config.get("validation_model"),
+        dependencies=config.get("dependencies"),
+        options=test_options,
+    )
+
+    assert result.error is None, f"Unbatched inference failed: {result.error}"
+    assert "text" in result.record
+    assert len(result.record["text"]) > 0
+
+
+def test_text_truncation(monkeypatch):
+    """Tests that full text is capped at MAX_TEXT_LENGTH exactly, and kept whole with force=True."""
+    audio_file = str(TEST_ASSETS / "OSR_uk_000_0020_8k.wav")
+
+    full = FasterWhisperTranscriber(file_path=audio_file).main(model_size="tiny")
+    assert full is not None
+    assert full["text"] == " ".join(seg["text"] for seg in full["segments"])
+
+    # A limit on the separator after the first segment, and two that fall inside segments
+    first_length = len(full["segments"][0]["text"])
+    limits = {first_length + 1, len(full["text"]) // 3, len(full["text"]) // 2 + 1}
+
+    for limit in sorted(limits):
+        monkeypatch.setattr(whisper_model, "MAX_TEXT_LENGTH", limit)
+
+        truncated = FasterWhisperTranscriber(file_path=audio_file).main(
+            model_size="tiny"
+        )
+        assert truncated is not None
+        assert len(truncated["text"]) == limit
+        assert truncated["text"] == full["text"][:limit]
+        assert truncated["segments"] == full["segments"]
+
+    forced = FasterWhisperTranscriber(file_path=audio_file).main(
+        model_size="tiny", force=True
+    )
+    assert forced is not None
+    assert forced["text"] == full["text"]
+
+
+class _FakeConverter:
+    """Stands in for TransformersConverter, writing a dummy model.bin."""
+
+    on_convert = None
+
+    def __init__(self, model_name_or_path, copy_files=None):
+        pass
+
+    def convert(self, output_dir, quantization=None, force=False):
+        (pathlib.Path(output_dir) / "model.bin").write_text("converted")
+        if _FakeConverter.on_convert:
+            _FakeConverter.on_convert(output_dir)
+        return output_dir
+
+
+@pytest.fixture
+def fake_converter(monkeypatch, tmp_path):
+    _FakeConverter.on_convert = None
+    monkeypatch.setattr(whisper_model, "CONVERTED_MODEL_DIR", tmp_path)
+    monkeypatch.setattr(whisper_model, "_can_convert", lambda: True)
+    monkeypatch.setattr(ctranslate2.converters, "TransformersConverter", _FakeConverter)
+    return _FakeConverter
+
+
+def test_conversion_renamed_into_place(fake_converter, tmp_path):
+    """Tests that a successful conversion ends up in the cache directory with no temporary left."""
+    result = whisper_model._ensure_converted("tiny", "int8")
+
+    assert result == str(tmp_path / "tiny-int8")
+    assert (tmp_path / "tiny-int8" / "model.bin").read_text() == "converted"
+    assert os.listdir(tmp_path) == ["tiny-int8"]
+
+
+def test_conversion_failure_cleans_up(fake_converter, tmp_path, caplog):
+    """Tests that a failed conversion leaves no partial cache or temporary directory behind."""
+
+    def fail(output_dir):
+        raise RuntimeError("conversion failed")
+
+    fake_converter.on_convert = fail
+
+    assert whisper_model._ensure_converted("tiny", "int8") == "tiny"
+    assert "conversion failed" in caplog.text
+    assert os.listdir(tmp_path) == []
+
+
+def test_conversion_race_reuses_winner(fake_converter, tmp_path):
+    """Tests that losing the rename to a concurrent conversion reuses the winner's copy."""
+
+    def win_race(output_dir):
+        (tmp_path / "tiny-int8").mkdir()
+        (tmp_path / "tiny-int8" / "model.bin").write_text("winner")
+
+    fake_converter.on_convert = win_race
+
+    assert whisper_model._ensure_converted("tiny", "int8") == str(
+        tmp_path / "tiny-int8"
+    )
+    assert (tmp_path / "tiny-int8" / "model.bin").read_text() == "winner"
+    assert os.listdir(tmp_path) == ["tiny-int8"]
+
+
+def test_stale_conversions_removed(fake_converter, tmp_path):
+    """Tests that temporary directories left by killed conversions are removed, but recent ones are kept."""
+    stale = tmp_path / ".tiny-int8-stale"
+    stale.mkdir()
+    old = time.time() - whisper_model.STALE_CONVERSION_SECONDS - 60
+    os.utime(stale, (old, old))
+    recent = tmp_path / ".tiny-int8-recent"
+    recent.mkdir()
+
+    whisper_model._ensure_converted("tiny", "int8")
+
+    assert sorted(os.listdir(tmp_path)) == [".tiny-int8-recent", "tiny-int8"]
+
+
+def _fake_torch(initialized=True, free_bytes=0, error=None):
+    def mem_get_info(device_index):
+        if error:
+            raise error
+        return free_bytes, free_bytes
+
+    cuda = types.SimpleNamespace(
+        is_initialized=lambda: initialized, mem_get_info=mem_get_info
+    )
+    return types.SimpleNamespace(cuda=cuda)
+
+
+def test_batch_size_probe(monkeypatch):
+    """Tests the default batch size, and that a missing or broken torch falls back instead of failing."""
+    assert whisper_model._pick_batch_size("cpu") == 4
+
+    monkeypatch.delitem(sys.modules, "torch", raising=False)
+    assert whisper_model._pick_batch_size("cuda") == 8
+
+    monkeypatch.setitem(sys.modules, "torch", _fake_torch(initialized=False))
+    assert whisper_model._pick_batch_size("cuda") == 8
+
+    monkeypatch.setitem(sys.modules, "torch", _fake_torch(free_bytes=20 * 1024**3))
+    assert whisper_model._pick_batch_size("cuda", 1) == 16
+
+    monkeypatch.setitem(sys.modules, "torch", _fake_torch(free_bytes=4 * 1024**3))
+    assert whisper_model._pick_batch_size("cuda") == 8
+
+    cpu_only_torch = _fake_torch(
+        error=AssertionError("Torch not compiled with CUDA enabled")
+    )
+    monkeypatch.setitem(sys.modules, "torch", cpu_only_torch)
+    assert whisper_model._pick_batch_size("cuda") == 8
+
+
+def test_failed_load_releases_lock(monkeypatch):
+    """Tests that a failed model load does not leave its per-model load lock behind."""
+    transcriber = FasterWhisperTranscriber(file_path="dummy.wav")
+    FasterWhisperTranscriber._model_cache.clear()
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("load failed")
+
+    monkeypatch.setattr(transcriber, "_create_model", fail)
+
+    with pytest.raises(RuntimeError, match="load failed"):
+        transcriber._load_model("tiny", compute_type="int8")
+
+    assert FasterWhisperTranscriber._load_locks == {}
+    assert FasterWhisperTranscriber._model_cache == {}
+
+
+def _record_model_attempts(monkeypatch, fail):
+    """Replaces WhisperModel with a stub recording every constructor call, raising fail(kwargs) when set."""
+    attempts = []
+
+    def whisper_model_stub(model_size_or_path, **kwargs):
+        attempts.append(kwargs)
+        error = fail(kwargs)
+        if error:
+            raise error
+        return types.SimpleNamespace(kwargs=kwargs)
+
+    monkeypatch.setattr(
+        whisper_model,
+        "_fw_module",
+        types.SimpleNamespace(WhisperModel=whisper_model_stub),
+    )
+    return attempts
+
+
+def test_model_load_fallback_order(monkeypatch):
+    """Tests that loading falls back from flash attention to a plain GPU load and finally to CPU int8."""
+    monkeypatch.setattr(whisper_model, "_cuda_available", lambda: True)
+    monkeypatch.setattr(whisper_model, "_supports_flash_attention", lambda: True)
+
+    def fail(kwargs):
+        if kwargs.get("flash_attention"):
+            return TypeError("unexpected keyword argument 'flash_attention'")
+        if kwargs["device"] != "cpu":
+            return RuntimeError("CUDA out of memory")
+        return None
+
+    attempts = _record_model_attempts(monkeypatch, fail)
+    transcriber = FasterWhisperTranscriber(file_path="dummy.wav")
+
+    model = transcriber._create_model(
+        whisper_model._fw_module, "tiny", "float16", False, None
+    )
+
+    assert [
+        (a["device"], a["compute_type"], a.get("flash_attention")) for a in attempts
+    ] == [
+        ("cuda", "float16", True),
+        ("auto", "float16", None),
+        ("cpu", "int8", None),
+    ]
+    assert model.kwargs is attempts[-1]
+
+
+def test_model_load_cpu_not_retried(monkeypatch):
+    """Tests that a failed CPU int8 load on a host without CUDA is not retried with identical arguments."""
+    monkeypatch.setattr(whisper_model, "_cuda_available", lambda: False)
+    attempts = _record_model_attempts(
+        monkeypatch, lambda kwargs: RuntimeError("corrupt model")
+    )
+    transcriber = FasterWhisperTranscriber(file_path="dummy.wav")
+
+    with pytest.raises(RuntimeError, match="corrupt model"):
+        transcriber._create_model(whisper_model._fw_module, "tiny", "int8", False, None)
+
+    assert len(attempts) == 1
+    assert attempts[0]["device"] == "cpu"
+
+
+class _StubModel:
+    """Stands in for a loaded WhisperModel, yielding one segment per text and recording transcribe() calls."""
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.calls = []
+        self.model = types.SimpleNamespace(device="cpu", device_index=[0])
+        self.feature_extractor = types.SimpleNamespace(sampling_rate=16000)
+
+    def transcribe(self, audio, **kwargs):
+        self.calls.append(kwargs)
+        info = types.SimpleNamespace(
+            duration=audio.shape[0] / 16000, language="en", language_probability=0.9
+        )
+        segments = (
+            types.SimpleNamespace(
+                text=text, start=float(i), end=i + 1.0, avg_logprob=-0.1, words=None
+            )
+            for i, text in enumerate(self.texts)
+        )
+        return segments, info
+
+
+def _stub_model(monkeypatch, texts=(" Hello there.",)):
+    stub = _StubModel(list(texts))
+    monkeypatch.setattr(
+        FasterWhisperTranscriber, "_load_model", lambda self, *args, **kwargs: stub
+    )
+    return stub
+
+
+def test_vad_skipped_for_short_media(monkeypatch):
+    """Tests that VAD is only skipped for media shorter than vad_min_duration."""
+    audio_file = str(TEST_ASSETS / "OSR_uk_000_0020_8k.wav")
+    stub = _stub_model(monkeypatch)
+
+    assert FasterWhisperTranscriber(file_path=audio_file).main() is not None
+    assert stub.calls[-1]["vad_filter"] is True
+
+    result = FasterWhisperTranscriber(file_path=audio_file).main(vad_min_duration=60.0)
+    assert result is not None
+    assert stub.calls[-1]["vad_filter"] is False
+
+
+def test_beam_size_defaults(monkeypatch):
+    """Tests greedy decoding for short media, beam search for long media, and explicit overrides."""
+    audio_file = str(TEST_ASSETS / "OSR_uk_000_0020_8k.wav")
+    stub = _stub_model(monkeypatch)
+
+    FasterWhisperTranscriber(file_path=audio_file).main()
+    assert stub.calls[-1]["beam_size"] == 1
+
+    FasterWhisperTranscriber(file_path=audio_file).main(beam_size=3)
+    assert stub.calls[-1]["beam_size"] == 3
+
+    monkeypatch.setattr(
+        faster_whisper, "decode_audio", lambda *args, **kwargs: np.zeros(16000 * 301)
+    )
+    FasterWhisperTranscriber(file_path=audio_file).main(vad_filter=False)
+    assert stub.calls[-1]["beam_size"] == 5
+
+
+def test_empty_segments_dropped(monkeypatch):
+    """Tests that empty and whitespace-only segments are skipped."""
+    audio_file = str(TEST_ASSETS / "OSR_uk_000_0020_8k.wav")
+    _stub_model(monkeypatch, texts=[" Hello.", "", "  ", " World."])
+
+    result = FasterWhisperTranscriber(file_path=audio_file).main()
+
+    assert result is not None
+    assert [segment["text"] for segment in result["segments"]] == ["Hello.", "World."]
+    assert result["text"] == "Hello. World."
+    assert "  " not in result["text"]
+
+
+def test_final_progress_update(monkeypatch):
+    """Tests that progress always finishes at the full media duration."""
+    audio_file = str(TEST_ASSETS / "OSR_uk_000_0020_8k.wav")
+    _stub_model(monkeypatch)
+    transcriber = FasterWhisperTranscriber(file_path=audio_file)
+    updates = []
+    monkeypatch.setattr(
+        transcriber,
+        "update_progress",
+        lambda current, total, *args, **kwargs: updates.append((current, total)),
+    )
+
+    result = transcriber.main()
+
+    assert result is not None
+    duration = round(result["duration"], 2)
+    assert updates[-1] == (duration, duration)
+
+
+def test_max_segments(monkeypatch, caplog):
+    """Tests that max_segments caps decoding and only warns when segments are dropped."""
+    audio_file = str(TEST_ASSETS / "OSR_uk_000_0020_8k.wav")
+
+    _stub_model(monkeypatch, texts=[f" Segment {i}." for i in range(3)])
+    with caplog.at_level("WARNING"):
+        result = FasterWhisperTranscriber(file_path=audio_file).main(max_segments=3)
+    assert result is not None
+    assert len(result["segments"]) == 3
+    assert "max_segments" not in caplog.text
+
+    _stub_model(monkeypatch, texts=[f" Segment {i}." for i in range(4)])
+    with caplog.at_level("WARNING"):
+        result = FasterWhisperTranscriber(file_path=audio_file).main(max_segments=3)
+    assert result is not None
+    assert len(result["segments"]) == 3
+    assert "Reached max_segments (3)" in caplog.text
+
+    transcriber = FasterWhisperTranscriber(file_path=audio_file)
+    assert transcriber.main(max_segments=0) is None
+    assert "Invalid max_segments" in transcriber.error